@@ -2,17 +2,25 @@ import asyncio
 import csv
 import json
 import os
+import re
+import zlib
+from collections.abc import Sequence
 from dataclasses import dataclass, asdict
-from typing import List, Set, Optional
-from urllib.parse import urljoin, urlparse
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from html import unescape
+from typing import Callable, Dict, List, Set, Optional
+from urllib.parse import urljoin, urlparse, urlsplit
 from urllib.robotparser import RobotFileParser
+from xml.etree import ElementTree as ET
 
 import aiohttp
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 import pandas as pd
 
 
-@dataclass
+@dataclass(slots=True)
 class PageResult:
     url: str
     title: str = ""
@@ -24,36 +32,143 @@ class PageResult:
     error: str = ""
 
 
+PROGRESS_INTERVAL = 0.1
+HTML_CONTENT_TYPES = frozenset({'text/html', 'application/xhtml+xml'})
+
+_SEO_SELECTOR = 'title, h1, meta[name], link[rel~=canonical]'
+_ATTR_VALUE = r'\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+))'
+# Whole attributes only, so an "href=" inside another attribute's value is not matched.
+_ATTRS_BEFORE = r'(?:\s+[^\s"\'=<>]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'<>][^\s<>]*))?)*?\s+'
+_HREF_RE = re.compile(r'<a' + _ATTRS_BEFORE + r'href' + _ATTR_VALUE, re.I)
+_BASE_RE = re.compile(r'<base' + _ATTRS_BEFORE + r'href' + _ATTR_VALUE, re.I)
+# Unclosed comments and scripts run to the end of input, as in browsers.
+_SKIP_RE = re.compile(r'<!--.*?(?:-->|\Z)|<(script|style)\b[^>]*>.*?(?:</\1\s*>|\Z)', re.I | re.S)
+_NETLOC_RE = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://([^/?#]*)')
+
+
+@lru_cache(maxsize=1024)
+def _netloc_host(netloc: str) -> str:
+    return urlsplit('//' + netloc).hostname or ''
+
+
+def _attr_value(match: re.Match) -> str:
+    value = match.group(1) or match.group(2) or match.group(3) or ''
+    return unescape(value) if '&' in value else value
+
+
+def url_host(url: str) -> str:
+    match = _NETLOC_RE.match(url)
+    return _netloc_host(match.group(1)) if match else ''
+
+
+RESULT_FIELDS = tuple(PageResult.__annotations__)
+
+
+class ResultsView(Sequence):
+    def __init__(self, columns: Dict[str, list]):
+        self._columns = columns
+
+    def __len__(self):
+        return len(self._columns['url'])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return PageResult(*(column[index] for column in self._columns.values()))
+
+
+def in_svg(node) -> bool:
+    parent = node.parent
+    while parent is not None:
+        if parent.tag == 'svg':
+            return True
+        parent = parent.parent
+    return False
+
+
+def page_row(page: PageResult) -> tuple:
+    return tuple(getattr(page, name) for name in RESULT_FIELDS)
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    if not value:
+        return 0.0
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
 class SEOCrawler:
     def __init__(self, base_url: str, *, max_depth: int = 2, max_pages: int = 100,
                  include_subdomains: bool = False, rate_limit: float = 1.0,
-                 autosave_interval: int = 50, session: Optional[aiohttp.ClientSession] = None):
+                 autosave_interval: int = 50, concurrency: int = 10, per_host_limit: int = 4,
+                 max_retries: int = 3, retry_backoff: float = 1.0,
+                 max_retry_after: float = 120.0, max_interval: float = 30.0,
+                 max_body_bytes: int = 5 * 1024 * 1024,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 session: Optional[aiohttp.ClientSession] = None):
         self.base_url = base_url.rstrip('/')
         self.parsed_base = urlparse(self.base_url)
+        self._base_host = self.parsed_base.hostname or ''
         self.max_depth = max_depth
         self.max_pages = max_pages
         self.include_subdomains = include_subdomains
         self.rate_limit = rate_limit
         self.autosave_interval = autosave_interval
-        self.results: List[PageResult] = []
+        self.concurrency = concurrency
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_retry_after = max_retry_after
+        self.max_interval = max_interval
+        self.max_body_bytes = max_body_bytes
+        self.progress_callback = progress_callback
+        self._cols: Dict[str, list] = {name: [] for name in RESULT_FIELDS}
         self.errors: List[PageResult] = []
         self.visited: Set[str] = set()
+        self.enqueued: Set[str] = set()
         self.to_visit: asyncio.Queue = asyncio.Queue()
         self.session = session
+        self._owns_session = session is None
         self.robot_parser = RobotFileParser()
-        self.last_request = 0.0
+        self._buckets: Dict[str, float] = {}
+        self._intervals: Dict[str, float] = {}
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight = 0
+        self._slot_freed = asyncio.Condition()
+        self._sitemap_task: Optional[asyncio.Task] = None
+        self._autosave_task: Optional[asyncio.Task] = None
+        self._since_save = 0
+        self._last_progress_tick = 0.0
+        self._allowed = lru_cache(maxsize=8192)(self._allowed_impl)
+
+    @property
+    def columns(self) -> Dict[str, list]:
+        return self._cols
+
+    @property
+    def results(self) -> 'ResultsView':
+        return ResultsView(self._cols)
 
     async def initialize(self):
         if not self.session:
-            self.session = aiohttp.ClientSession()
-        await self.load_robots(self.session)
-        await self.load_sitemap(self.session)
-        await self.to_visit.put((self.base_url, 0))
+            connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host_limit)
+            self.session = aiohttp.ClientSession(connector=connector)
+        self._sitemap_task = asyncio.create_task(self.load_sitemap())
+        await self.load_robots()
+        await self.enqueue(self.base_url, 0)
 
-    async def load_robots(self, session: aiohttp.ClientSession):
+    async def load_robots(self):
         robots_url = urljoin(self.base_url, '/robots.txt')
         try:
-            async with session.get(robots_url) as resp:
+            async with self.session.get(robots_url) as resp:
                 if resp.status == 200:
                     text = await resp.text()
                     self.robot_parser.parse(text.splitlines())
@@ -63,98 +178,276 @@ class SEOCrawler:
         except Exception as exc:
             self.robot_parser = RobotFileParser()
             self.robot_parser.parse([])
+        self._allowed.cache_clear()
 
-    async def load_sitemap(self, session: aiohttp.ClientSession):
+    async def load_sitemap(self):
         sitemap_url = urljoin(self.base_url, '/sitemap.xml')
         try:
-            async with session.get(sitemap_url) as resp:
-                if resp.status == 200:
-                    text = await resp.text()
-                    from xml.etree import ElementTree as ET
-                    root = ET.fromstring(text)
-                    for loc in root.iterfind('.//{*}loc'):
-                        url = loc.text.strip()
-                        await self.to_visit.put((url, 0))
+            async with self.session.get(sitemap_url) as resp:
+                if resp.status != 200:
+                    return
+                parser = ET.XMLPullParser(['end'])
+                gunzip = None
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    if gunzip is None:
+                        gunzip = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk[:2] == b'\x1f\x8b' else False
+                    parser.feed(gunzip.decompress(chunk) if gunzip else chunk)
+                    for _, elem in parser.read_events():
+                        if elem.tag.rpartition('}')[2] == 'loc' and elem.text:
+                            await self.enqueue(elem.text.strip(), 0)
+                        elem.clear()
         except Exception:
             pass
 
     def allowed(self, url: str) -> bool:
+        return self._allowed(url)
+
+    def _allowed_impl(self, url: str) -> bool:
         if not self.include_subdomains:
-            parsed = urlparse(url)
-            if parsed.hostname and parsed.hostname != self.parsed_base.hostname:
+            host = url_host(url)
+            if host and host != self._base_host:
                 return False
         return self.robot_parser.can_fetch('*', url)
 
     async def crawl(self):
-        await self.initialize()
-        while not self.to_visit.empty() and len(self.results) < self.max_pages:
-            url, depth = await self.to_visit.get()
-            if url in self.visited or depth > self.max_depth:
-                continue
-            if not self.allowed(url):
-                continue
-            self.visited.add(url)
-            await self.rate_limit_wait()
+        workers = []
+        try:
+            await self.initialize()
+            workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+            await self._sitemap_task
+            await self.to_visit.join()
+            for _ in workers:
+                await self.to_visit.put(None)
+            await asyncio.gather(*workers)
+            if self._autosave_task:
+                await self._autosave_task
+                if self._since_save > 0:
+                    await self.autosave()
+        finally:
+            if self._sitemap_task:
+                self._sitemap_task.cancel()
+            for task in workers:
+                task.cancel()
+            if self._owns_session and self.session and not self.session.closed:
+                await self.session.close()
+
+    async def worker(self):
+        while True:
+            item = await self.to_visit.get()
             try:
-                async with self.session.get(url) as resp:
-                    status = resp.status
-                    text = await resp.text(errors='ignore')
+                if item is None:
+                    return
+                url, depth = item
+                try:
+                    await self.process(url, depth)
+                except Exception as exc:
+                    self.errors.append(PageResult(url=url, status=0, error=str(exc)))
+            finally:
+                self.to_visit.task_done()
+
+    async def process(self, url: str, depth: int):
+        if url in self.visited or depth > self.max_depth:
+            return
+        if not self.allowed(url):
+            return
+        if not await self.reserve_slot():
+            return
+        self.visited.add(url)
+        try:
+            try:
+                status, text = await self.fetch(url)
             except Exception as exc:
                 self.errors.append(PageResult(url=url, status=0, error=str(exc)))
-                continue
-            page = self.parse_page(url, status, text)
+                return
+            if text is None:
+                tree = None
+                page = PageResult(url=url, status=status)
+            else:
+                tree = LexborHTMLParser(text)
+                page = self.parse_page(url, status, tree)
             if status != 200:
                 self.errors.append(page)
-            self.results.append(page)
-            if len(self.results) % self.autosave_interval == 0:
-                self.autosave()
-            if status == 200 and depth < self.max_depth:
-                for link in self.extract_links(text, url):
-                    if link not in self.visited:
-                        await self.to_visit.put((link, depth + 1))
-        if self.session and not self.session.closed:
-            await self.session.close()
-
-    async def rate_limit_wait(self):
-        elapsed = asyncio.get_event_loop().time() - self.last_request
-        wait_for = self.rate_limit - elapsed
-        if wait_for > 0:
-            await asyncio.sleep(wait_for)
-        self.last_request = asyncio.get_event_loop().time()
-
-    def parse_page(self, url: str, status: int, html: str) -> PageResult:
-        soup = BeautifulSoup(html, 'html.parser')
-        title = soup.title.string.strip() if soup.title and soup.title.string else ''
-        desc_tag = soup.find('meta', attrs={'name': 'description'})
-        description = desc_tag['content'].strip() if desc_tag and desc_tag.get('content') else ''
-        h1_tag = soup.find('h1')
-        h1 = h1_tag.get_text(strip=True) if h1_tag else ''
-        canonical_tag = soup.find('link', rel='canonical')
-        canonical = canonical_tag['href'].strip() if canonical_tag and canonical_tag.get('href') else ''
-        robots_tag = soup.find('meta', attrs={'name': 'robots'})
-        meta_robots = robots_tag['content'].strip() if robots_tag and robots_tag.get('content') else ''
+            for column, value in zip(self._cols.values(), page_row(page)):
+                column.append(value)
+        finally:
+            await self.release_slot()
+        self.report_progress()
+        self._since_save += 1
+        if self._since_save >= self.autosave_interval and self.schedule_autosave():
+            self._since_save = 0
+        if tree is not None and status == 200 and depth < self.max_depth:
+            for link in self.extract_links(text, url):
+                await self.enqueue(link, depth + 1)
+
+    async def reserve_slot(self) -> bool:
+        # Wait for in-flight fetches to settle rather than dropping the URL:
+        # a failed fetch frees its slot without adding a result.
+        async with self._slot_freed:
+            while len(self._cols['url']) + self._in_flight >= self.max_pages:
+                if len(self._cols['url']) >= self.max_pages:
+                    return False
+                await self._slot_freed.wait()
+            self._in_flight += 1
+            return True
+
+    async def release_slot(self):
+        async with self._slot_freed:
+            self._in_flight -= 1
+            self._slot_freed.notify_all()
+
+    async def enqueue(self, url: str, depth: int):
+        if url in self.enqueued:
+            return
+        self.enqueued.add(url)
+        await self.to_visit.put((url, depth))
+
+    async def fetch(self, url: str):
+        host = url_host(url)
+        attempt = 0
+        while True:
+            await self.rate_limit_wait(host)
+            async with self.host_limit(host):
+                async with self.session.get(url) as resp:
+                    status = resp.status
+                    retry_after = self.adjust_rate(host, status, resp.headers)
+                    if retry_after > self.max_retry_after:
+                        raise RuntimeError(f'Retry-After of {retry_after:.0f}s exceeds '
+                                           f'max_retry_after ({self.max_retry_after:.0f}s)')
+                    retry = (status == 429 or status >= 500) and attempt < self.max_retries
+                    if not retry:
+                        # aiohttp reports application/octet-stream when the header is
+                        # missing; only skip bodies that are declared as non-HTML.
+                        if 'Content-Type' in resp.headers and resp.content_type not in HTML_CONTENT_TYPES:
+                            return status, None
+                        return status, await self.read_body(resp)
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            attempt += 1
+
+    async def read_body(self, resp: aiohttp.ClientResponse) -> str:
+        chunks = []
+        size = 0
+        async for chunk in resp.content.iter_chunked(64 * 1024):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_body_bytes:
+                break
+        body = b''.join(chunks)[:self.max_body_bytes]
+        try:
+            return body.decode(resp.charset or 'utf-8', errors='ignore')
+        except LookupError:
+            return body.decode('utf-8', errors='ignore')
+
+    def host_limit(self, host: str) -> asyncio.Semaphore:
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        return limit
+
+    async def rate_limit_wait(self, host: str):
+        now = asyncio.get_event_loop().time()
+        interval = self._intervals.get(host, self.rate_limit)
+        slot = max(self._buckets.get(host, 0.0) + interval, now)
+        self._buckets[host] = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def adjust_rate(self, host: str, status: int, headers) -> float:
+        interval = self._intervals.get(host, self.rate_limit)
+        remaining = headers.get('X-RateLimit-Remaining')
+        if remaining is not None and remaining.strip().isdigit():
+            if int(remaining) == 0:
+                interval = min(max(interval * 2, 0.1), max(self.max_interval, self.rate_limit))
+            else:
+                interval = max(interval / 2, self.rate_limit)
+        self._intervals[host] = interval
+        if status not in (429, 503):
+            return 0.0
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if 0 < retry_after <= self.max_retry_after:
+            now = asyncio.get_event_loop().time()
+            self._buckets[host] = max(self._buckets.get(host, 0.0), now + retry_after - interval)
+        return retry_after
+
+    def parse_page(self, url: str, status: int, tree: LexborHTMLParser) -> PageResult:
+        # One document-wide match in document order: Lexbor moves head elements
+        # that follow stray body content into <body>, so <head> alone is not enough.
+        title = description = h1 = canonical = meta_robots = None
+        for tag in tree.css(_SEO_SELECTOR):
+            name = tag.tag
+            if name == 'title':
+                if title is None and not in_svg(tag):
+                    title = tag.text(strip=True)
+            elif name == 'h1':
+                if h1 is None:
+                    h1 = tag.text(strip=True)
+            elif name == 'meta':
+                attrs = tag.attributes
+                meta_name = (attrs.get('name') or '').lower()
+                if meta_name == 'description' and description is None:
+                    description = (attrs.get('content') or '').strip()
+                elif meta_name == 'robots' and meta_robots is None:
+                    meta_robots = (attrs.get('content') or '').strip()
+            elif name == 'link' and canonical is None:
+                canonical = (tag.attributes.get('href') or '').strip()
+        title = title or ''
+        description = description or ''
+        h1 = h1 or ''
+        canonical = canonical or ''
+        meta_robots = meta_robots or ''
         return PageResult(url, title, description, h1, canonical, meta_robots, status)
 
     def extract_links(self, html: str, base_url: str) -> List[str]:
-        soup = BeautifulSoup(html, 'html.parser')
+        html = _SKIP_RE.sub('', html)
+        base_tag = _BASE_RE.search(html)
+        if base_tag and _attr_value(base_tag).strip():
+            base_url = urljoin(base_url, _attr_value(base_tag).strip())
         links = []
-        for a in soup.find_all('a', href=True):
-            href = urljoin(base_url, a['href'])
+        seen = set()
+        for match in _HREF_RE.finditer(html):
+            raw = _attr_value(match).strip()
+            if not raw:
+                continue
+            href = urljoin(base_url, raw)
+            if href in seen or href in self.enqueued:
+                continue
+            seen.add(href)
             if href.startswith('http') and self.allowed(href):
                 links.append(href)
         return links
 
-    def autosave(self):
-        df = pd.DataFrame([asdict(r) for r in self.results])
-        df.to_csv('autosave.csv', index=False)
-        df.to_excel('autosave.xlsx', index=False)
+    def report_progress(self):
+        if not self.progress_callback:
+            return
+        done = len(self._cols['url'])
+        now = asyncio.get_event_loop().time()
+        if done < self.max_pages and now - self._last_progress_tick < PROGRESS_INTERVAL:
+            return
+        self._last_progress_tick = now
+        self.progress_callback(done, self.max_pages)
+
+    def schedule_autosave(self) -> bool:
+        if self._autosave_task and not self._autosave_task.done():
+            return False
+        self._autosave_task = asyncio.create_task(self.autosave())
+        return True
+
+    async def autosave(self):
+        snapshot = {name: column[:] for name, column in self._cols.items()}
+        await asyncio.to_thread(self._do_autosave, snapshot)
+
+    def _do_autosave(self, columns: Dict[str, list]):
+        pd.DataFrame(columns, copy=False).to_feather('autosave.feather')
 
-    def export(self, basename: str = 'results'):
-        df = pd.DataFrame([asdict(r) for r in self.results])
-        df.to_csv(f'{basename}.csv', index=False)
-        df.to_excel(f'{basename}.xlsx', index=False)
+    def export(self, basename: str = 'results', *, with_csv: bool = False, with_excel: bool = False):
+        df = pd.DataFrame(self._cols, copy=False)
+        df.to_parquet(f'{basename}.parquet', compression='zstd', index=False)
+        if with_csv:
+            df.to_csv(f'{basename}.csv', index=False)
+        if with_excel:
+            df.to_excel(f'{basename}.xlsx', index=False)
         with open(f'{basename}.json', 'w', encoding='utf-8') as f:
-            json.dump([asdict(r) for r in self.results], f, ensure_ascii=False, indent=2)
+            json.dump([dict(zip(RESULT_FIELDS, row)) for row in zip(*self._cols.values())],
+                      f, ensure_ascii=False, indent=2)
         if self.errors:
             with open(f'{basename}_errors.log', 'w', encoding='utf-8') as f:
                 writer = csv.writer(f)
@@ -1,25 +1,31 @@
 import asyncio
-from dataclasses import asdict
+import os
 from functools import partial
 
+import qasync
 from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+from PyQt5.QtGui import QBrush, QColor
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton,
     QProgressBar, QPlainTextEdit, QTableView, QFileDialog, QLabel, QSpinBox
 )
 
-from .crawler import SEOCrawler, PageResult
+from .crawler import SEOCrawler, RESULT_FIELDS
+
+_ERR_BRUSH = QBrush(QColor('#ffcccc'))
 
 
 class ResultTableModel(QAbstractTableModel):
     headers = ["URL", "Title", "Description", "H1", "Canonical", "Meta Robots", "Status"]
+    _field_names = [h.replace(' ', '_').lower() for h in headers]
 
-    def __init__(self, data):
+    def __init__(self, columns=None):
         super().__init__()
-        self._data = data
+        self._columns = columns if columns is not None else {name: [] for name in RESULT_FIELDS}
+        self._rows = len(self._columns['url'])
 
     def rowCount(self, parent=QModelIndex()):
-        return len(self._data)
+        return self._rows
 
     def columnCount(self, parent=QModelIndex()):
         return len(self.headers)
@@ -29,12 +35,10 @@ class ResultTableModel(QAbstractTableModel):
             return None
         row = index.row()
         col = index.column()
-        page = self._data[row]
         if role == Qt.DisplayRole:
-            return asdict(page)[self.headers[col].replace(' ', '_').lower()]
-        if role == Qt.BackgroundRole and page.status != 200:
-            from PyQt5.QtGui import QBrush, QColor
-            return QBrush(QColor('#ffcccc'))
+            return self._columns[self._field_names[col]][row]
+        if role == Qt.BackgroundRole and self._columns['status'][row] != 200:
+            return _ERR_BRUSH
         return None
 
     def headerData(self, section, orientation, role=Qt.DisplayRole):
@@ -42,8 +46,19 @@ class ResultTableModel(QAbstractTableModel):
             return self.headers[section]
         return super().headerData(section, orientation, role)
 
-    def update(self):
-        self.layoutChanged.emit()
+    def set_columns(self, columns):
+        self.beginResetModel()
+        self._columns = columns
+        self._rows = len(columns['url'])
+        self.endResetModel()
+
+    def append_rows(self):
+        total = len(self._columns['url'])
+        if total <= self._rows:
+            return
+        self.beginInsertRows(QModelIndex(), self._rows, total - 1)
+        self._rows = total
+        self.endInsertRows()
 
 
 class MainWindow(QWidget):
@@ -77,7 +92,7 @@ class MainWindow(QWidget):
         self.progress = QProgressBar()
         layout.addWidget(self.progress)
 
-        self.table_model = ResultTableModel([])
+        self.table_model = ResultTableModel()
         self.proxy_model = QSortFilterProxyModel()
         self.proxy_model.setSourceModel(self.table_model)
         self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
@@ -106,10 +121,12 @@ class MainWindow(QWidget):
         self.log.appendPlainText(msg)
 
     def export_results(self):
-        path, _ = QFileDialog.getSaveFileName(self, "Save", "results.csv", "CSV (*.csv)")
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Save", "results.parquet", "Parquet (*.parquet);;CSV (*.csv);;Excel (*.xlsx)")
         if not path:
             return
-        self.crawler.export(path.rsplit('.', 1)[0])
+        basename, ext = os.path.splitext(path)
+        self.crawler.export(basename, with_csv=ext == '.csv', with_excel=ext == '.xlsx')
         self.log_message(f"Exported to {path}")
 
     def start_crawl(self):
@@ -117,26 +134,32 @@ class MainWindow(QWidget):
         if not url:
             return
         autosave = self.autosave_spin.value()
-        self.crawler = SEOCrawler(url, autosave_interval=autosave)
-        self.table_model._data = self.crawler.results
-        self.table_model.update()
+        self.crawler = SEOCrawler(url, autosave_interval=autosave, progress_callback=self.on_progress)
+        self.table_model.set_columns(self.crawler.columns)
         self.progress.setValue(0)
         self.log_message("Starting crawl...")
         asyncio.ensure_future(self.run_crawl())
 
+    def on_progress(self, done: int, total: int):
+        self.table_model.append_rows()
+        self.progress.setValue(int(done * 100 / total) if total else 0)
+
     async def run_crawl(self):
         await self.crawler.crawl()
-        self.table_model.update()
+        self.table_model.append_rows()
         self.log_message("Crawl finished")
         self.progress.setValue(100)
 
 
 def run_app():
     app = QApplication([])
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
     window = MainWindow()
     window.resize(800, 600)
     window.show()
-    asyncio.get_event_loop().run_until_complete(app.exec_())
+    with loop:
+        loop.run_forever()
 
 
 if __name__ == "__main__":